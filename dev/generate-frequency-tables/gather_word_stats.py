@@ -14,6 +14,7 @@ import code
 from   datetime import datetime
 import IPython
 import logging
+from   multiprocessing import Pool
 import os
 import plac
 import Pyro4
@@ -31,18 +32,36 @@ except:
 from extractor_client import *
 
 
+# Each worker process in word_frequencies_for_repos() has its own connection
+# to the extractor server, set up by _connect_extractor().
+_extractor = None
+
+def _connect_extractor(uri, key):
+    global _extractor
+    _extractor = Extractor(uri, key)
+
+
+def _words_for_repo(id, recache):
+    log = Logger().get_log()
+    log.info('Getting words for {}'.format(id))
+    return _extractor.get_words(id, recache=recache)
+
+
 def word_frequencies_for_repos(repo_ids, lang, uri, key,
-                               lowercase=False, recache=False):
+                               lowercase=False, recache=False, threads=5):
     from nltk.probability import FreqDist
     log = Logger().get_log()
-    extractor = Extractor(uri, key)
-    words = []
+    ids = []
     for id in repo_ids:
         if not id:
             log.info('Ignoring blank line')
             continue
-        log.info('Getting words for {}'.format(id))
-        words = words + extractor.get_words(id, recache=recache)
+        ids.append(id)
+    words = []
+    with Pool(threads, _connect_extractor, (uri, key)) as pool:
+        for repo_words in pool.starmap(_words_for_repo,
+                                       [(id, recache) for id in ids]):
+            words.extend(repo_words)
     if lowercase == 'all':
         log.info('Lower-casing all words.')
         words = [w.lower() for w in words]
@@ -57,12 +76,13 @@ def word_frequencies_for_repos(repo_ids, lang, uri, key,
 # Argument annotations are: (help, kind, abbrev, type, choices, metavar)
 # Plac automatically adds a -h argument for help, so no need to do it here.
 
-def run(key=None, uri=None, recache=False, *file):
+def run(key=None, uri=None, recache=False, threads=5, *file):
     '''Test gather_word_stats.py.'''
     if len(file) < 1:
         raise SystemExit('Need a file as argument')
     log = Logger(sys.argv[0], console=True).get_log()
     log.set_level('debug')
+    threads = int(threads)
     filename = file[0]
     if not os.path.exists(filename):
         raise ValueError('File {} not found'.format(filename))
@@ -73,13 +93,15 @@ def run(key=None, uri=None, recache=False, *file):
         id_list = f.read().splitlines()
 
     log.info('Running word_statistics')
-    freq = word_frequencies_for_repos(id_list, 'Python', uri, key, recache=recache)
+    freq = word_frequencies_for_repos(id_list, 'Python', uri, key,
+                                      recache=recache, threads=threads)
     print(tabulate_frequencies(freq))
 
 run.__annotations__ = dict(
     uri     = ('URI to connect to',    'option', 'u'),
     key     = ('crypto key',           'option', 'k'),
     recache = ('invalidate the cache', 'flag',   'r'),
+    threads = ('max number of processes', 'option', 't'),
     file    = 'file of repo identifiers',
 )
 
@@ -1,5 +1,5 @@
 from .constants import *
-from .file_parser import file_elements
+from .file_parser import file_elements, file_elements_batch
 from .dir_parser import dir_elements
-from .text_extractor import extract_text, clean_plain_text, tokenize_text, all_words, word_frequencies, tabulate_frequencies
+from .text_extractor import extract_text, extract_text_batch, clean_plain_text, tokenize_text, all_words, word_frequencies, tabulate_frequencies
 from .extractor_client import Extractor
@@ -131,29 +131,21 @@
 # succeeded but extracting the remaining file elements may fail.  In that
 # case, the extractor will return what it could get.
 
-import bs4
-import chardet
 from   datetime import datetime
 from   fnmatch import fnmatch
-import html2text
 import locale
 import io
 import keyword
-import magic
-import markdown
 import math
-import nltk
 import operator
 import os
 import plac
-import pypandoc
 import re
+import stat
 import sys
 import tempfile
-import textile
 from   time import sleep
 from   timeit import default_timer as timer
-from   tokenize import tokenize, COMMENT, STRING, NAME
 
 try:
     sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
@@ -184,6 +176,17 @@ _content_check_size    = 512
 _max_file_size         = 1024*1024
 _extreme_max_file_size = 5*1024*1024
 
+# Kinds of files, indexed by lower-cased file name extension.  Files without
+# an extension are listed as documents, but python_file() looks inside them
+# first in case they are Python scripts.
+_extension_kinds = dict.fromkeys(common_puretext_extensions
+                                 + common_text_markup_extensions
+                                 + convertible_document_extensions, 'document')
+_extension_kinds.update(dict.fromkeys(['.py', '.wsgi', '.ipynb'], 'python'))
+
+# Handle on the log, fetched once by _logger() and reused after that.
+_log = None
+
 
 # Main functions
 # .............................................................................
@@ -192,7 +195,7 @@ def dir_elements(path, recache=False, filtering='normal'):
     def wrapper_dict(path, elements):
         return {'full_path': path, 'elements': elements}
 
-    log = Logger().get_log()
+    log = _logger()
     full_path = os.path.join(os.getcwd(), path)
 
     # Check if the destination really exists and is readable to us.
@@ -239,7 +242,7 @@ def dir_elements_recursive(path, filtering):
 
     # Recursive directory walker.
     full_path = os.path.join(os.getcwd(), path)
-    log = Logger().get_log()
+    log = _logger()
     log.info('beginning traversal of {}'.format(full_path))
     walker = os.walk(path)
 
@@ -250,20 +253,24 @@ def dir_elements_recursive(path, filtering):
         os.chdir(path)
         contents = []
         for file in files:
-            if not os.path.exists(file):
+            # Stat the file once and hand the result to the size and type
+            # tests below, instead of having each of them stat it again.
+            try:
+                st = os.stat(file)
+            except OSError:
                 # Can happen if something creates a temporary file in-between
                 # time we call os.walk and the time we get to processing file.
                 log.warn('non-existent file: {}'.format(file))
                 continue
-            elif excessively_large_file(file):
+            if excessively_large_file(st):
                 log.debug('skipping large text file: {}'.format(file))
                 contents.append(file_dict(file, None, None, None, 'large'))
                 continue
-            elif empty_file(file):
+            elif empty_file(st):
                 log.debug('skipping empty file: {}'.format(file))
                 contents.append(file_dict(file, '', None, None, 'empty'))
                 continue
-            elif ignorable_file(file):
+            elif ignorable_file(file, st):
                 log.debug('skipping ignorable file: {}'.format(file))
                 contents.append(file_dict(file, None, None, None, 'ignored'))
                 continue
@@ -307,13 +314,24 @@ def dir_elements_recursive(path, filtering):
 # Utilities.
 # .............................................................................
 
-def empty_file(filename):
-    return os.path.getsize(filename) == 0
+def _logger():
+    # This is not done at import time because the calling program sets up
+    # the Logger only after it has imported this module.
+    global _log
+    if _log is None:
+        _log = Logger().get_log()
+    return _log
+
 
+def empty_file(st):
+    '''Argument 'st' is the result of os.stat() on the file.'''
+    return st.st_size == 0
 
-def ignorable_file(filename):
-    return (not os.path.isfile(filename)
-            or os.path.getsize(filename) > _extreme_max_file_size
+
+def ignorable_file(filename, st):
+    '''Argument 'st' is the result of os.stat() on the file.'''
+    return (not stat.S_ISREG(st.st_mode)
+            or st.st_size > _extreme_max_file_size
             or any(fnmatch(filename, pat) for pat in common_ignorable_files))
 
 
@@ -328,16 +346,26 @@ def unhandled_file(filename):
     return any(fnmatch(name, pat) for pat in common_unhandled_files)
 
 
+def file_extension(filename):
+    # Same result as os.path.splitext(filename.lower())[1], but faster.  As
+    # with splitext, leading dots (as in ".bashrc") do not start an extension.
+    start = filename.rfind(os.sep) + 1
+    dot = filename.rfind('.')
+    if dot > start and filename[start:dot].lstrip('.'):
+        return filename[dot:].lower()
+    return ''
+
+
 def python_file(filename):
-    name, ext = os.path.splitext(filename.lower())
-    if ext in ['.py', '.wsgi', '.ipynb']:
+    ext = file_extension(filename)
+    if _extension_kinds.get(ext) == 'python':
         return True
     if ext == '':
         # No extension, but might still be a python file.
         try:
             return 'Python' in file_magic(filename)
         except Exception as e:
-            log = Logger().get_log()
+            log = _logger()
             log.error('unable to check if {} is a Python file: {}'.format(filename, e))
             log.error(e)
     return False
@@ -349,7 +377,7 @@ def ipynb_to_python_file(infile, outfile, timeout=20):
     (status, output, errors) = shell_cmd(cmd, max_time=timeout)
     if status == 0:
         return
-    log = Logger().get_log()
+    log = _logger()
     log.debug(' '.join(cmd))
     if status == -9:
         log.error('*** {} killed after {}s timeout'.format(cmd[0], timeout))
@@ -358,8 +386,9 @@ def ipynb_to_python_file(infile, outfile, timeout=20):
         return
 
 
-def excessively_large_file(filename):
-    return os.path.getsize(filename) > _max_file_size
+def excessively_large_file(st):
+    '''Argument 'st' is the result of os.stat() on the file.'''
+    return st.st_size > _max_file_size
 
 
 def readme_file(filename):
@@ -370,10 +399,7 @@ def readme_file(filename):
 def document_file(filename):
     if readme_file(filename):
         return True
-    name, ext = os.path.splitext(filename.lower())
-    if (ext in common_puretext_extensions
-        or ext in common_text_markup_extensions
-        or ext in convertible_document_extensions):
+    if _extension_kinds.get(file_extension(filename)) == 'document':
         return True
     elif not code_filename(filename):
         return probably_text(filename)
@@ -385,7 +411,7 @@ def probably_text(filename):
     try:
         return 'text' in file_magic(filename)
     except Exception as e:
-        log = Logger().get_log()
+        log = _logger()
         log.error('error trying to get magic for {}'.format(filename))
         log.error(e)
         return False
@@ -405,6 +431,9 @@ def elements_text_language(elements):
 
 
 def file_magic(filename):
+    # Imported here rather than at the top because libmagic is only needed
+    # for files whose type we can't tell from the name.
+    import magic
     # I don't know what's going on but magic.from_file() returns a byte array
     # on some systems and a string on others.
     code = magic.from_file(filename)
@@ -54,7 +54,7 @@ class Extractor(object):
         try:
             self._extractor._pyroReconnect(tries=10)
             return True
-        except Exception:
+        except Exception as err:
             self._log.error('Lost connection to server: {}'.format(err))
             return False
 
@@ -64,6 +64,29 @@ class Extractor(object):
             raise ValueError('Arg must be an int or a string: {}'.format(id))
 
 
+    def _remote_call(self, default, name, *args):
+        '''Call the server method 'name' with 'args'.  If the network
+        connection has been closed, this tries once to reconnect and repeat
+        the call.  Any other exception from the remote side is logged along
+        with the Pyro traceback.  In either case, if the call does not
+        succeed, this returns 'default'.'''
+        retried = False
+        while True:
+            try:
+                return getattr(self._extractor, name)(*args)
+            except Pyro4.errors.ConnectionClosedError as err:
+                # Network connection lost.
+                self._log.error('Network connection lost: {}'.format(err))
+                if retried or not self._reconnect():
+                    return default
+                retried = True
+            except Exception as err:
+                self._log.error('{}() exception: {}'.format(name, err))
+                self._log.error('------ Pyro traceback ------')
+                self._log.error(''.join(Pyro4.util.getPyroTraceback()))
+                return default
+
+
     def set_max_threads(self, num):
         if not isinstance(num, int):
             raise ValueError('Arg must be an int: {}'.format(num))
@@ -76,17 +99,7 @@ class Extractor(object):
 
     def get_repo_path(self, id):
         self._sanity_check_id(id)
-        try:
-            return self._extractor.get_repo_path(id)
-        except Pyro4.errors.ConnectionClosedError:
-            # Network connection lost.
-            self._log.error('Network connection lost: {}'.format(err))
-            return []
-        except Exception as err:
-            self._log.error('get_repo_path() exception: {}'.format(err))
-            self._log.error('------ Pyro traceback ------')
-            self._log.error(''.join(Pyro4.util.getPyroTraceback()))
-            return ''
+        return self._remote_call('', 'get_repo_path', id)
 
 
     def get_elements(self, id_list, recache=False, filtering='normal'):
@@ -94,44 +107,14 @@ class Extractor(object):
         if not isinstance(id_list, list):
             id_list = list(id_list)
         self._sanity_check_id(id_list[0])
-        try:
-            return self._extractor.get_elements(id_list, recache, filtering)
-        except Pyro4.errors.ConnectionClosedError:
-            # Network connection lost.
-            self._log.error('Network connection lost: {}'.format(err))
-            return []
-        except Exception as err:
-            self._log.error('get_elements() exception: {}'.format(err))
-            self._log.error('------ Pyro traceback ------')
-            self._log.error(''.join(Pyro4.util.getPyroTraceback()))
-            return []
+        return self._remote_call([], 'get_elements', id_list, recache, filtering)
 
 
     def get_words(self, id, filetype='all', recache=False):
         self._sanity_check_id(id)
-        try:
-            return self._extractor.get_words(id, filetype, recache)
-        except Pyro4.errors.ConnectionClosedError:
-            # Network connection lost.
-            self._log.error('Network connection lost: {}'.format(err))
-            return []
-        except Exception as err:
-            self._log.error('get_words() exception: {}'.format(err))
-            self._log.error('------ Pyro traceback ------')
-            self._log.error(''.join(Pyro4.util.getPyroTraceback()))
-            return []
+        return self._remote_call([], 'get_words', id, filetype, recache)
 
 
     def get_identifiers(self, id, recache=False):
         self._sanity_check_id(id)
-        try:
-            return self._extractor.get_identifiers(id, recache)
-        except Pyro4.errors.ConnectionClosedError:
-            # Network connection lost.
-            self._log.error('Network connection lost: {}'.format(err))
-            return []
-        except Exception as err:
-            self._log.error('get_identifiers() exception: {}'.format(err))
-            self._log.error('------ Pyro traceback ------')
-            self._log.error(''.join(Pyro4.util.getPyroTraceback()))
-            return []
+        return self._remote_call([], 'get_identifiers', id, recache)
@@ -11,18 +11,21 @@
 # ------------------------------------------------------------------------- -->
 
 import ast
-from   collections import deque, Counter
+from   collections import Counter
+import functools
 import io, keyword
+import itertools
 import math
+from   multiprocessing import Pool
 import operator
 import os
 import plac
 import re
-import shutil
 import sys
-import tempfile
+import threading
 import token
 from   tokenize import *
+import warnings
 
 try:
     sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
@@ -50,18 +53,51 @@ _min_name_len = 3
 _min_comment_len = 4
 _min_string_len = 6
 
+# Number of parsed ASTs kept by parsed_source().  ASTs take many times the
+# memory of the source text, so this is kept small.
+_parse_cache_size = 32
+
+# Number of results kept by cached_clean_text().  The same text (license
+# headers, common messages) turns up over and over again across files.
+# Longer texts are rarely repeated exactly, so they are not kept.
+_clean_cache_size = 8192
+_clean_cache_max_length = 1024
+
+# Fixers from lib2to3 applied by convert_python2_source().  We only need
+# enough of the conversion to let the Python 3 parser read the file.
+_python2_fixers = ['print', 'except', 'exec', 'funcattrs', 'unicode', 'ne',
+                   'numliterals', 'paren', 'repr', 'raise']
+
+# The lib2to3 refactoring tools, created the first time they are needed.  A
+# RefactoringTool keeps state while it works, so each thread gets its own.
+_refactoring_tools = threading.local()
+
+# Set to False when lib2to3 turns out not to be available (it was removed in
+# Python 3.13).  Python 2 files are then parsed without being converted.
+_lib2to3_available = None
+
 # Separator lines, or other comment lines without any text:
 # Coding line at top of file is per https://www.python.org/dev/peps/pep-0263/
+# The patterns are combined into one regexp so that testing a comment takes
+# a single call to the regexp engine.  They are matched at the start of the
+# comment, so they don't need a leading '^'.
 
 _comment_start    = '#'
-_nontext_comment  = re.compile(r'^[^A-Za-z]+$')
-_hashbang_comment = re.compile('^#!.*$')
-_coding_comment   = re.compile('^[ \t\v]*.*?coding[:=]')
-_vim_comment      = re.compile('^[ \t\v]*vim')
-_emacs_comment    = re.compile('^[ \t\v]*-\*-[ \t]+mode:')
-
-# Some symbols in Python code are not useful to us.
-_ignorable_names = [
+_comment_start_bytes = b'#'
+_nontext_comment  = r'[^A-Za-z]+$'
+_hashbang_comment = r'#!.*$'
+_coding_comment   = r'[ \t\v]*.*?coding[:=]'
+_vim_comment      = r'[ \t\v]*vim'
+_emacs_comment    = r'[ \t\v]*-\*-[ \t]+mode:'
+_ignorable_comment_match = re.compile('|'.join([_nontext_comment,
+                                                _hashbang_comment,
+                                                _coding_comment,
+                                                _vim_comment,
+                                                _emacs_comment])).match
+
+# Some symbols in Python code are not useful to us.  These are stored as sets
+# because they're tested against every name found in a file.
+_ignorable_names = frozenset([
     # Python idioms.
     '_',
 
@@ -93,10 +129,13 @@ _ignorable_names = [
     '__code__', '__globals__', '__dict__', '__closure__', '__annotations__',
     '__kwdefaults__', '__self__', '__func__', '__instancecheck__',
     '__subclasscheck__', 'metaclass',
-]
+])
+
+# The same names as a tuple, for use with str.endswith().
+_ignorable_suffixes = tuple(_ignorable_names)
 
 # Additional Python smbols that may or may not be important to filter out.
-_common_python_names = [
+_common_python_names = frozenset([
     # Common Python built-in functions.
     # See https://docs.python.org/3/library/functions.html
     'abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray', 'bytes',
@@ -118,15 +157,31 @@ _common_python_names = [
     'SystemExit', 'StopIteration', 'KeyError', 'RuntimeError',
     'to_bytes', 'from_bytes', 'bit_length', 'is_integer', 'as_integer_ratio',
     'fromhex',
-]
+])
 
 
+# Fields of AST nodes that never lead to anything ElementCollector collects:
+# plain values such as identifiers, and expression contexts and operators.
+_skipped_ast_fields = frozenset([
+    'id', 'attr', 'name', 'asname', 'arg', 'module', 'level', 'kind',
+    'conversion', 'is_async', 'type_comment', 'ctx', 'op', 'ops',
+])
+
+# Fields of each AST node class that ElementCollector descends into.  This is
+# filled in by child_fields() as new node classes are encountered.
+_child_fields = {}
+
+
 # Utility classes.
 # .............................................................................
 
 class ElementCollector(ast.NodeVisitor):
     '''AST node visitor for creating lists of elements that we care about.'''
 
+    # Map from AST node class to the (unbound) method that handles it.  This
+    # is shared by all instances and filled in by visitor() as needed.
+    _dispatch = {}
+
     def __init__(self, filtering_level='normal'):
         self.imports    = []
         self.classes    = []
@@ -144,10 +199,6 @@ class ElementCollector(ast.NodeVisitor):
             self.ignorable_name = self.ignorable_name_minimal
 
 
-    def operation_on_variable(self, name):
-        return any(name in x for x in self.variables)
-
-
     def ignorable_string(self, thing):
         # Only store long strings with at least one space in them,
         # in the hope that they're useful messages
@@ -163,8 +214,59 @@ class ElementCollector(ast.NodeVisitor):
                 or thing in _common_python_names)
 
 
+    def visit(self, node):
+        # Same as ast.NodeVisitor.visit(), but remembers the method found for
+        # each node class instead of constructing its name for every node.
+        kind = type(node)
+        method = self._dispatch.get(kind) or self.visitor(kind)
+        return method(self, node)
+
+
+    @classmethod
+    def visitor(cls, kind):
+        # Node classes without a visit_* method and without any fields worth
+        # descending into (e.g., Name, Pass) are skipped outright.
+        method = getattr(cls, 'visit_' + kind.__name__, None)
+        if method is None:
+            method = cls.generic_visit if child_fields(kind) else cls.skip
+        cls._dispatch[kind] = method
+        return method
+
+
+    def skip(self, node):
+        pass
+
+
     def generic_visit(self, node):
-        super(ElementCollector, self).generic_visit(node)
+        # This does the same as ast.NodeVisitor.generic_visit(), but only
+        # looks at fields that can lead to something we collect, and walks
+        # down through nodes that have no visit_* method of their own using
+        # a stack instead of recursion.  Long expressions (e.g., a string
+        # built from hundreds of concatenations) thus no longer use up the
+        # recursion limit, and each such node costs a few list operations
+        # instead of two method calls.
+        generic = ElementCollector.generic_visit
+        dispatch = self._dispatch
+        stack = []
+        push_children(node, stack)
+        while stack:
+            node = stack.pop()
+            kind = type(node)
+            method = dispatch.get(kind) or self.visitor(kind)
+            if method is generic:
+                push_children(node, stack)
+            else:
+                method(self, node)
+
+
+    def body_after_docstring(self, node):
+        # Store the doc string of a function or class, if it has one, and
+        # return the rest of the body.
+        docstring = ast.get_docstring(node, clean=False)
+        if docstring:
+            self.docstrings.append(docstring)
+            return node.body[1:]
+        return node.body
 
 
     def visit_Str(self, node):
@@ -172,26 +274,18 @@ class ElementCollector(ast.NodeVisitor):
             self.strings.append(node.s)
 
 
-    def visit_List(self, node):
-        if hasattr(node, 'elts'):
-            for thing in node.elts:
-                self.visit(thing)
+    def visit_Constant(self, node):
+        # Python 3.8 and later produce Constant nodes for all literals.
+        if isinstance(node.value, str) and not self.ignorable_string(node.value):
+            self.strings.append(node.value)
 
 
     def visit_Assign(self, node):
         for thing in node.targets:
-            name_visitor = NameVisitor()
-            name_visitor.visit(thing)
-            name = name_visitor.name
+            name = extract_name(thing)
             if not self.ignorable_name(name):
-                path = []
-                if self._current_function:
-                    path.append(self._current_function)
-                elif self._current_class:
-                    path.append(self._current_class)
-                path.append(name)
-                var_name = '|'.join(path)
-                self.variables.append(var_name)
+                scope = self._current_function or self._current_class
+                self.variables.append((scope, name))
         self.visit(node.value)
 
 
@@ -204,7 +298,7 @@ class ElementCollector(ast.NodeVisitor):
             for var in tuple:
                 if hasattr(var, 'id'):
                     if not self.ignorable_name(var.id):
-                        self.variables.append(var.id)
+                        self.variables.append((None, var.id))
                 elif isinstance(var, ast.Tuple):
                     iterate_tuples(var.elts)
                 else:
@@ -212,7 +306,7 @@ class ElementCollector(ast.NodeVisitor):
 
         if isinstance(node.target, ast.Name):
             if not self.ignorable_name(node.target.id):
-                self.variables.append(node.target.id)
+                self.variables.append((None, node.target.id))
         elif isinstance(node.target, ast.Tuple):
             iterate_tuples(node.target.elts)
         elif isinstance(node.target, ast.List):
@@ -223,22 +317,16 @@ class ElementCollector(ast.NodeVisitor):
 
 
     def visit_Call(self, node):
-        callvisitor = NameVisitor()
-        callvisitor.visit(node.func)
-        if not self.ignorable_name(callvisitor.name):
-            self.calls.append(callvisitor.name)
+        name = extract_name(node.func)
+        if not self.ignorable_name(name):
+            self.calls.append(name)
         for thing in node.args:
             self.visit(thing)
         for thing in node.keywords:
             name = thing.arg
             if not self.ignorable_name(name):
-                path = []
-                if self._current_function:
-                    path.append(self._current_function)
-                elif self._current_class:
-                    path.append(self._current_class)
-                path.append(name)
-                arg_name = '.'.join(path)
+                scope = self._current_function or self._current_class
+                arg_name = scope + '.' + name if scope else name
                 self.functions.append(arg_name)
             self.visit(thing.value)
 
@@ -246,58 +334,24 @@ class ElementCollector(ast.NodeVisitor):
     def visit_FunctionDef(self, node):
         func_name = None
         if not self.ignorable_name(node.name):
-            path = []
-            if self._current_function:
-                path.append(self._current_function)
-            elif self._current_class:
-                path.append(self._current_class)
-            path.append(node.name)
-            func_name = '.'.join(path)
+            scope = self._current_function or self._current_class
+            func_name = scope + '.' + node.name if scope else node.name
             self.functions.append(func_name)
         # Treat function parameter names as vars.
         for arg in node.args.args:
             if not self.ignorable_name(arg.arg):
-                # Do the same trick with the names as we do for other vars.
-                path = []
-                if func_name:
-                    path.append(func_name)
-                elif self._current_class:
-                    path.append(self._current_class)
-                path.append(arg.arg)
-                var_name = '|'.join(path)
-                self.variables.append(var_name)
+                # Record the scope with the name as we do for other vars.
+                scope = func_name or self._current_class
+                self.variables.append((scope, arg.arg))
         # Check for keyword arg deafult values.
         for arg in node.args.defaults:
             self.visit(arg)
-        # Check if there's a doc string.
-        if len(node.body) > 0 and hasattr(node.body[0], 'value'):
-            first_thing = node.body[0].value
-            if isinstance(first_thing, ast.Str) and first_thing.s:
-                self.docstrings.append(first_thing.s)
-                # Process the body, skipping the doc string.
-                for thing in node.body[1:]:
-                    self._current_function = func_name
-                    self.visit(thing)
-                    self._current_function = None
-            else:
-                # Process the body.
-                for thing in node.body:
-                    self._current_function = func_name
-                    self.visit(thing)
-                    self._current_function = None
-        else:
-            # Process the body.
-            for thing in node.body:
-                self._current_function = func_name
-                self.visit(thing)
-                self._current_function = None
-
-
-    def visit_Function(self, node):
-        self.functions.append(node.name)
-        # Treat function parameter names as vars.
-        for arg in node.arguments.args:
-            self.calls.append(arg.id)
+        # Process the body, skipping the doc string if there is one.
+        enclosing_function = self._current_function
+        self._current_function = func_name
+        for thing in self.body_after_docstring(node):
+            self.visit(thing)
+        self._current_function = enclosing_function
 
 
     def visit_Import(self, node):
@@ -325,108 +379,109 @@ class ElementCollector(ast.NodeVisitor):
     def visit_ClassDef(self, node):
         class_name = None
         if not self.ignorable_name(node.name):
-            path = []
-            if self._current_function:
-                path.append(self._current_function)
-            elif self._current_class:
-                path.append(self._current_class)
-            path.append(node.name)
-            class_name = '.'.join(path)
+            scope = self._current_function or self._current_class
+            class_name = scope + '.' + node.name if scope else node.name
             self.classes.append(class_name)
-        # Check if there's a doc string.
-        if len(node.body) > 0 and hasattr(node.body[0], 'value'):
-            first_thing = node.body[0].value
-            if isinstance(first_thing, ast.Str) and first_thing.s:
-                self.docstrings.append(first_thing.s)
-            # Process the body, skipping the doc string.
-            for thing in node.body[1:]:
-                self._current_class = class_name
-                self.visit(thing)
-                self._current_class = None
-        else:
-            # Process the body.
-            for thing in node.body:
-                self._current_class = class_name
-                self.visit(thing)
-                self._current_class = None
-
-
-# NameVisitor started as code from https://suhas.org/function-call-ast-python
-# but has since been heavily modified.
-
-class NameVisitor(ast.NodeVisitor):
-    '''Extract the name from a node.'''
-
-    def __init__(self):
-        self._name = deque()
-
-
-    @property
-    def name(self):
-        return '.'.join(self._name)
-
-
-    @name.deleter
-    def name(self):
-        self._name.clear()
-
-
-    def visit_Name(self, node):
-        self._name.appendleft(node.id)
+        # Process the body, skipping the doc string if there is one.  The
+        # class name already includes any enclosing function, and inside the
+        # class body it is the innermost scope, so the function is cleared.
+        enclosing_class = self._current_class
+        enclosing_function = self._current_function
+        self._current_class = class_name
+        self._current_function = None
+        for thing in self.body_after_docstring(node):
+            self.visit(thing)
+        self._current_class = enclosing_class
+        self._current_function = enclosing_function
 
 
-    def visit_Call(self, node):
-        if hasattr(node.func, 'attr'):
-            self._name.appendleft(node.func.attr)
-        if hasattr(node.func, 'value'):
-            if hasattr(node.func.value, 'id'):
-                self._name.appendleft(node.func.value.id)
-            elif hasattr(node.func.value, 'attr'):
-                self._name.appendleft(node.func.value.attr)
-            else:
-                # Chained calls like foo().bar().baz()
-                self.generic_visit(node.func.value)
-        elif hasattr(node.func, 'id'):
-            self._name.appendleft(node.func.id)
-
+# Utilities.
+# .............................................................................
 
-    def visit_Attribute(self, node):
+def child_fields(kind):
+    '''Return the names of the fields of AST node class 'kind' that may lead
+    to elements collected by ElementCollector.'''
+    fields = _child_fields.get(kind)
+    if fields is None:
+        fields = tuple(f for f in kind._fields if f not in _skipped_ast_fields)
+        _child_fields[kind] = fields
+    return fields
+
+
+def push_children(node, stack):
+    '''Push the children of 'node' that may lead to collected elements onto
+    'stack', last one first, so that popping them yields them in order.'''
+    for field in reversed(child_fields(type(node))):
+        value = getattr(node, field, None)
+        if type(value) is list:
+            stack.extend(item for item in reversed(value)
+                         if isinstance(item, ast.AST))
+        elif isinstance(value, ast.AST):
+            stack.append(value)
+
+
+# extract_name() started as the NameVisitor class, which was based on code
+# from https://suhas.org/function-call-ast-python but has since been heavily
+# modified.  It is now a pair of plain functions, because creating a visitor
+# object for every assignment target and function call was costly.
+
+def extract_name(node):
+    '''Extract the name from a node.  Attribute references are returned as
+    dotted names, e.g. "foo.bar", without any leading "self".'''
+    parts = []
+    _gather_name_parts(node, parts)
+    return '.'.join(reversed(parts))
+
+
+def _gather_name_parts(node, parts):
+    # Name parts are gathered from the end of the name towards the start.
+    kind = type(node)
+    if kind is ast.Name:
+        parts.append(node.id)
+    elif kind is ast.Attribute:
         # This gets called for variable assignments too.
-        try:
-            self._name.appendleft(node.attr)
+        parts.append(node.attr)
+        if type(node.value) is ast.Name:
             # Adding 'self' does not really provide much info, so skip it.
             if node.value.id != 'self':
-                self._name.appendleft(node.value.id)
-        except AttributeError:
-            self.generic_visit(node)
+                parts.append(node.value.id)
+        else:
+            _gather_name_parts(node.value, parts)
+    elif kind is ast.Call:
+        func = node.func
+        if hasattr(func, 'attr'):
+            parts.append(func.attr)
+        if hasattr(func, 'value'):
+            if hasattr(func.value, 'id'):
+                parts.append(func.value.id)
+            elif hasattr(func.value, 'attr'):
+                parts.append(func.value.attr)
+            else:
+                # Chained calls like foo().bar().baz()
+                for child in ast.iter_child_nodes(func.value):
+                    _gather_name_parts(child, parts)
+        elif hasattr(func, 'id'):
+            parts.append(func.id)
+    else:
+        for child in ast.iter_child_nodes(node):
+            _gather_name_parts(child, parts)
 
-
-# Utilities.
-# .............................................................................
 
 def ignorable_comment(thing):
-    return (thing.strip().startswith(_comment_start) and
+    # Comment tokens never have leading white space, so no need to strip.
+    return (thing.startswith(_comment_start) and
             (len(thing) < _min_comment_len
-             or re.match(_nontext_comment, thing)
-             or re.match(_coding_comment, thing)
-             or re.match(_vim_comment, thing)
-             or re.match(_emacs_comment, thing)
-             or re.match(_hashbang_comment, thing)))
+             or _ignorable_comment_match(thing) is not None))
 
 
 def strip_comment_char(text):
-    i = 0
-    max = len(text)
-    while i < max and text[i] in ['#', ' ', '\t']:
-        i += 1
-    return text[i:]
+    return text.lstrip('# \t')
 
 
 def uniquify(seq):
-    # From a posting by Dave Kirby in August 2006 to the blog here:
-    # https://www.peterbe.com/plog/uniqifiers-benchmark
-    seen = set()
-    return [x for x in seq if x not in seen and not seen.add(x)]
+    # Dicts preserve insertion order, so this keeps the first occurrence of
+    # each item in its original position.
+    return list(dict.fromkeys(seq))
 
 
 def skip_to_eol(tokens):
@@ -438,67 +493,97 @@ def skip_to_eol(tokens):
 def filter_variables(calls, vars):
     # If a call is an operation on a variable, like "foo.append", it's usually
     # a common Python thing like a list operation.  We remove it.
-    results = []
-    for call in calls:
-        if not any(call.endswith(name) for name in _ignorable_names):
-            results.append(call)
-    return results
+    return [call for call in calls if not call.endswith(_ignorable_suffixes)]
 
 
 def countify(seq):
     return Counter(seq).most_common()
 
 
-def assumes_python2(stream):
-    try:
-        # If AST doesn't bail, we assume it uses Python 3 syntax.
-        tree = ast.parse(stream.read())
-        stream.seek(0)
-        return False
-    except SyntaxError:
-        # This almost always means that the code is in Python 2.
-        return True
-    except Exception as err:
-        log = Logger().get_log()
-        log.error('unexpected problem trying to guess if file is Python 2')
-        log.error(err)
-        return False
+def count_clean_strings(strings):
+    # Same as countify() on the cleaned, non-empty strings, but each distinct
+    # string is cleaned only once.  Different strings can clean up to the
+    # same text, so the counts are merged after cleaning.
+    counts = Counter()
+    for string, count in Counter(strings).items():
+        cleaned = cached_clean_text(string)
+        if cleaned:
+            counts[cleaned] += count
+    return counts.most_common()
+
+
+@functools.lru_cache(maxsize=_parse_cache_size)
+def parsed_source(source):
+    '''Return the AST for 'source', which must be a bytes object.  Results are
+    cached, so that identical contents (e.g., the same file in different
+    forks of a repository) are only parsed once.  Callers must not modify
+    the tree returned.'''
+    return ast.parse(source)
+
+
+def python2_refactoring_tool():
+    '''Return this thread's lib2to3 refactoring tool, creating it if
+    necessary, or None if lib2to3 is not available in this version of
+    Python.  The first time lib2to3 is found to be missing, a warning is
+    logged.'''
+    global _lib2to3_available
+    tool = getattr(_refactoring_tools, 'tool', None)
+    if tool is None and _lib2to3_available is not False:
+        try:
+            # lib2to3 warns on import that it is deprecated.  We know.
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', DeprecationWarning)
+                warnings.simplefilter('ignore', PendingDeprecationWarning)
+                from lib2to3.refactor import RefactoringTool
+        except ImportError:
+            _lib2to3_available = False
+            log = Logger().get_log()
+            log.warn('lib2to3 is not available -- Python 2 files will not be converted')
+            return None
+        fixers = ['lib2to3.fixes.fix_' + name for name in _python2_fixers]
+        tool = _refactoring_tools.tool = RefactoringTool(fixers)
+    return tool
 
 
-def convert_python2_file(filename):
-    '''Convert Python 2 file to (limited) Python 3.  Returns the file name
-    of the file containing the converted code.  The caller must delete this
-    file after it's done.'''
+def convert_python2_source(source, filename):
+    '''Convert Python 2 code to (limited) Python 3.  Argument 'source' is the
+    contents of the file 'filename', as bytes.  Returns the converted code
+    as bytes, or None if the conversion failed.  If lib2to3 is not available,
+    'source' is returned unconverted.'''
 
     log = Logger().get_log()
-    working_file = tempfile.NamedTemporaryFile()
-    cmd = ['2to3', '-w', '-W', '-n', '-f', 'print', '-f', 'except',
-           '-f', 'exec', '-f', 'funcattrs', '-f', 'unicode', '-f', 'ne',
-           '-f', 'numliterals', '-f', 'paren', '-f', 'repr', '-f', 'raise',
-           working_file.name]
     try:
-        log.debug(cmd)
-        full_path = os.path.join(os.getcwd(), filename)
-        shutil.copyfile(full_path, working_file.name)
-        (status, output, errors) = shell_cmd(cmd)
-        if status == 0:
-            log.debug('converted {}'.format(filename))
-            return working_file
-        elif os.path.exists(working_file.name):
-            working_file.close()
-        log.warn('2to3 failed to convert {} -- status {}'.format(full_path, status))
-        return None
+        refactoring_tool = python2_refactoring_tool()
+        if refactoring_tool is None:
+            return source
+        # Like the 2to3 command, add a newline to avoid some parse errors,
+        # and write the result back out in the file's own encoding.
+        encoding, _ = detect_encoding(io.BytesIO(source).readline)
+        text = source.decode(encoding) + '\n'
+        tree = refactoring_tool.refactor_string(text, filename)
+        log.debug('converted {}'.format(filename))
+        return str(tree)[:-1].encode(encoding)
     except Exception as err:
-        log = Logger().get_log()
         log.error('Exception trying to convert {}'.format(filename))
         log.error(err)
-        if os.path.exists(working_file.name):
-            working_file.close()
         return None
 
 
+def cached_clean_text(text):
+    '''Same as clean_plain_text(), but remembers recent results for short
+    texts.'''
+    if len(text) > _clean_cache_max_length:
+        return clean_plain_text(text)
+    return _short_clean_text(text)
+
+
+@functools.lru_cache(maxsize=_clean_cache_size)
+def _short_clean_text(text):
+    return clean_plain_text(text)
+
+
 def clean_plain_text_list(text):
-    text = [clean_plain_text(string) for string in text]
+    text = [cached_clean_text(string) for string in text]
     return [string for string in text if string]
 
 
@@ -514,17 +599,10 @@ def file_elements(filename, filtering='normal'):
     Argument 'filterint' determines how much filtering is applied to symbols
     that may be uninteresting.  Possible values are 'minimal' or 'normal'.
     '''
-    header    = ''
+    header    = []
     comments  = []
-    tmp_file  = None
     full_path = os.path.join(os.getcwd(), filename)
 
-    def cleanup():
-        stream.close()
-        if tmp_file:
-            log.debug('closing {}'.format(tmp_file))
-            tmp_file.close()
-
     # Set up the dictionary.  We may end up returning only part of this
     # filled out, if we encounter errors along the way.
 
@@ -540,29 +618,40 @@ def file_elements(filename, filtering='normal'):
     elements['calls']        = []
     elements['parse_result'] = 'success'
 
-    # Open the file for reading.  FileIO is needed for the Python 'ast' module.
+    # Read the whole file once.  The same bytes are handed to both the
+    # tokenizer and the AST parser below.
 
     log = Logger('file_parser').get_log()
     log.info('parsing Python file {}'.format(full_path))
-    stream = io.FileIO(filename)
+    with open(filename, 'rb') as f:
+        source = f.read()
 
     # Pass #0: account for Python 2 vs 3 syntax.
     # I haven't found another way to detect whether a script uses Python 2 or
     # 3 syntax other than to try to parse it and test for failure.  We need
     # to use ast later below, and if an input file needs Python 2, we have to
-    # convert it first.  So we test first and convert at the beginning.
+    # convert it first.  So we parse first and convert at the beginning.  If
+    # the parse succeeds, the tree is kept and used in pass #2.
 
-    if assumes_python2(stream):
+    tree = None
+    python2 = False
+    try:
+        # If AST doesn't bail, we assume it uses Python 3 syntax.
+        tree = parsed_source(source)
+    except SyntaxError:
+        # This almost always means that the code is in Python 2.
+        python2 = True
+    except Exception as err:
+        log.error('unexpected problem trying to guess if file is Python 2')
+        log.error(err)
+
+    if python2:
         try:
-            # This creates a temporary file that must be deleted later.
             log.debug('attempting to convert from Python 2')
-            tmp_file = convert_python2_file(filename)
-            if tmp_file:
+            converted = convert_python2_source(source, full_path)
+            if converted is not None:
                 log.debug('conversion successful'.format(full_path))
-                log.debug('closing file {}'.format(full_path))
-                stream.close()
-                log.debug('opening file {}'.format(tmp_file.name))
-                stream = io.FileIO(tmp_file.name)
+                source = converted
             else:
                 # We thought it was Python 2 but couldn't convert it.
                 # Something is wrong. Bail.
@@ -574,19 +663,17 @@ def file_elements(filename, filtering='normal'):
             log.error('error trying to detect if {} uses Python 2'.format(full_path))
             log.error(err)
             elements['parse_result'] = 'error'
-            cleanup()
             return elements
 
     # Pass #1: use tokenize to find and store headers and comments.
 
     log.debug('tokenizing {}'.format(full_path))
     try:
-        tokens = tokenize(stream.readline)
+        tokens = tokenize(io.BytesIO(source).readline)
     except Exception as err:
         log.error('error trying to tokenize {}'.format(full_path))
         log.error(err)
         elements['parse_result'] = 'error'
-        cleanup()
         return elements
 
     # Look for a header at the top, if any.  There are two common forms in
@@ -603,87 +690,88 @@ def file_elements(filename, filtering='normal'):
             continue
         if kind != COMMENT and kind != NL:
             break
-        header += strip_comment_char(thing)
+        header.append(strip_comment_char(thing))
 
     # When the above ends, 'thing' & 'kind' will be the next values to examine.
-    # If it's a string, it's assumed to be the file doc string.
-    # Once we do this, we'll have read the header comment or the doc string and
-    # the file position will be immediately after that point.  When we do our
-    # 2nd pass, we don't want to read that stuff again.  Back up over the last
-    # non-string/comment thing we read, and remember where we are.
-
-    if kind == STRING:
-        restart_point = stream.tell()
-        header = header + ' ' + thing.replace('"', '')
+    # If it's a string, it's assumed to be the file doc string.  It becomes
+    # part of the header, so pass #2 below must not count it a second time.
+
+    header_docstring = (kind == STRING)
+    if header_docstring:
+        header.append(' ' + thing.replace('"', ''))
         (kind, thing, _, _, line) = next(tokens)
-    else:
-        restart_point = stream.tell() - len(line)
 
     # Iterate through the rest of the file, looking for comments.
     # This gathers consecutive comment lines together, on the premise that
     # they may contain sentences split across multiple comment lines.
+    # Comment tokens can only exist if there is a '#' somewhere in the file;
+    # if there isn't, a single C-level scan lets us skip the tokenizer loop.
 
-    chunk = ''
-    while thing != ENDMARKER:
+    chunk = []
+    if _comment_start_bytes in source:
         try:
-            if kind == NL:
-                pass
-            elif kind == COMMENT and not ignorable_comment(thing):
-                chunk = chunk + strip_comment_char(thing) + '\n'
-            elif chunk:
-                comments.append(chunk.strip())
-                chunk = ''
-            (kind, thing, _, _, _) = next(tokens)
-        except StopIteration:
-            break
+            remaining = itertools.chain([(kind, thing, None, None, None)], tokens)
+            for kind, thing, _, _, _ in remaining:
+                # Most tokens are code and arrive with no chunk pending, so
+                # they cost just the first two tests here.
+                if kind == COMMENT and not ignorable_comment(thing):
+                    chunk.append(strip_comment_char(thing))
+                elif chunk and kind != NL:
+                    comments.append('\n'.join(chunk).strip())
+                    chunk = []
         except Exception:
             # Unicode decoding problems can cause exceptions.
             log.error('tokenization failed for {}'.format(full_path))
-            break
 
     # This concludes what we gather without parsing the file into an AST.
     # Store the header and comments, if any.
 
-    elements['header']     = clean_plain_text(header)
+    elements['header']     = cached_clean_text(''.join(header))
     elements['comments']   = clean_plain_text_list(comments)
 
-    # Pass #2: pull out remaining elements separately using the AST.  This is
-    # inefficient, because we're iterating over the file a 2nd time, but our
-    # efforts right now are about getting things to work any way possible.
+    # Pass #2: pull out remaining elements separately using the AST.  If the
+    # file was converted from Python 2, the converted code still needs to be
+    # parsed; otherwise we already have the tree from pass #0.
 
     # AST parsing failures are possible here, particularly if the file was
     # converted from Python 2.  Some programs do stuff you can't automatically
     # convert with 2to3.  If that happens, bail and return what we can.
 
-    stream.seek(restart_point)
     try:
-        log.debug('parsing into AST')
-        tree = ast.parse(stream.read())
+        if tree is None:
+            log.debug('parsing into AST')
+            tree = parsed_source(source)
     except Exception as err:
         log.error('AST parsing failed; returning what we have so far'.format(full_path))
-        cleanup()
         elements['parse_result'] = 'error'
         return elements
 
-    # We were able to parse the file into an AST.
+    # We were able to parse the file into an AST.  Skip the file doc string
+    # if we already put it in the header.  (The tree may be shared with other
+    # callers via the parse cache, so we can't simply delete the node.)
+
+    body = tree.body
+    if header_docstring and ast.get_docstring(tree, clean=False) is not None:
+        body = body[1:]
 
     try:
         collector = ElementCollector(filtering)
-        collector.visit(tree)
+        for node in body:
+            collector.visit(node)
     except Exception as err:
         log.error('internal AST code walking error'.format(full_path))
-        cleanup()
         elements['parse_result'] = 'error'
         return elements
 
-    # We store the names of variables we find temporarily as paths separated
-    # by '|' so that we can find unique variable name assignments within each
-    # function or class context.  E.g., variable x in function foo is "foo|x".
-    # Remove the paths now, leaving just the variable names.
+    # We store the names of variables we find temporarily as (scope, name)
+    # pairs so that we can find unique variable name assignments within each
+    # function or class context.  E.g., variable x in function foo is
+    # ('foo', 'x'), and a variable outside any function or class is (None, x).
+    # Remove the scopes now, leaving just the variable names.
     # Also filter the variables to remove things we don't bother with.
 
-    unique_var_paths = list(set(collector.variables))
-    collector.variables = [x[x.rfind('|')+1:] for x in unique_var_paths]
+    unique_var_paths = uniquify(collector.variables)
+    collector.variables = [name for (_, name) in unique_var_paths]
     filtered_calls = filter_variables(collector.calls, collector.variables)
 
     # We are done.  Do final cleanup and count up frequencies of some things.
@@ -695,18 +783,29 @@ def file_elements(filename, filtering='normal'):
     elements['classes']    = countify(collector.classes)
     elements['functions']  = countify(collector.functions)
     elements['variables']  = countify(collector.variables)
-    elements['strings']    = countify(clean_plain_text_list(collector.strings))
+    elements['strings']    = count_clean_strings(collector.strings)
     elements['calls']      = countify(filtered_calls)
 
-    cleanup()
     return elements
 
+
+def file_elements_batch(filenames, filtering='normal', processes=None):
+    '''Run file_elements() on each of the files in 'filenames' using a pool
+    of worker processes, and return a dictionary mapping each file name to
+    its elements.  Argument 'processes' is the number of workers; the
+    default is the number of CPUs.'''
+    parse = functools.partial(file_elements, filtering=filtering)
+    with Pool(processes) as pool:
+        results = pool.map(parse, filenames, chunksize=8)
+    return dict(zip(filenames, results))
+
 
 # Quick test interface.
 # .............................................................................
 
 def run_file_parser(debug=False, ppr=False, loglevel='debug', *file):
-    '''Test file_parser.py.'''
+    '''Test file_parser.py.  If more than one file is given, they are
+    parsed in parallel using file_elements_batch().'''
     if len(file) < 1:
         raise SystemExit('Need a file as argument')
     log = Logger(os.path.splitext(sys.argv[0])[0], console=True).get_log()
@@ -714,10 +813,13 @@ def run_file_parser(debug=False, ppr=False, loglevel='debug', *file):
         log.set_level('debug')
     else:
         log.set_level(loglevel)
-    filename = file[0]
-    if not os.path.exists(filename):
-        raise ValueError('File {} not found'.format(filename))
-    e = file_elements(filename)
+    for filename in file:
+        if not os.path.exists(filename):
+            raise ValueError('File {} not found'.format(filename))
+    if len(file) > 1:
+        e = file_elements_batch(list(file))
+    else:
+        e = file_elements(file[0])
     if debug:
         import ipdb; ipdb.set_trace()
     if ppr:
@@ -730,7 +832,7 @@ run_file_parser.__annotations__ = dict(
     debug    = ('drop into ipdb after parsing',     'flag',   'd'),
     ppr      = ('use pprint to print result',       'flag',   'p'),
     loglevel = ('logging level: "debug" or "info"', 'option', 'L'),
-    file     = 'file to parse',
+    file     = 'file(s) to parse',
 )
 
 if __name__ == '__main__':
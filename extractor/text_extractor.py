@@ -10,29 +10,26 @@
 # Inventory Creation System.  For more information, visit http://casics.org.
 # ------------------------------------------------------------------------- -->
 
-import bs4
-import chardet
 from   datetime import datetime
 from   fnmatch import fnmatch
-import html2text
+import functools
 import locale
 import io
 import keyword
-import markdown
 import math
-from   multiprocessing import Process, Manager
+from   multiprocessing import Pool, Process, Manager
 import nltk
 import operator
 import os
 import plac
 import re
+import string
 import subprocess
 import sys
 import tempfile
-import textile
+import threading
 from   time import sleep
 from   timeit import default_timer as timer
-from   tokenize import tokenize, COMMENT, STRING, NAME
 from   nltk.tokenize.punkt import PunktSentenceTokenizer, PunktParameters, PunktLanguageVars
 from   nltk.tokenize.api import TokenizerI
 import nltk.data
@@ -60,6 +57,7 @@ from extractor.constants import *
 
 _hard_split_chars = '~_.:0123456789'
 _hard_splitter    = str.maketrans(_hard_split_chars, ' '*len(_hard_split_chars))
+_hard_split       = re.compile('[' + re.escape(_hard_split_chars) + ' ]+').split
 _two_capitals     = re.compile(r'[A-Z][A-Z]')
 _camel_case       = re.compile(r'((?<=[a-z])[A-Z])')
 
@@ -68,9 +66,9 @@ def safe_camelcase_split(identifier):
     transitions.  This means it will split fooBarBaz into 'foo', 'Bar' and
     'Baz', but it won't change SQLlite or similar identifiers.  Does not
     split identifies that have multiple adjacent uppercase letters.'''
-    if re.search(_two_capitals, identifier):
+    if _two_capitals.search(identifier):
         return [identifier]
-    return re.sub(_camel_case, r' \1', identifier).split()
+    return _camel_case.sub(r' \1', identifier).split()
 
 def safe_simple_split(identifier):
     '''Split identifiers by hard delimiters such as underscores, digits, and
@@ -84,8 +82,8 @@ def safe_simple_split(identifier):
     ['a', 'Fast', 'NDecoder'] even though "NDecoder" may be more properly split
     as 'N' 'Decoder'.
     '''
-    parts = str.translate(identifier, _hard_splitter).split(' ')
-    return list(flatten(safe_camelcase_split(token) for token in parts))
+    parts = _hard_split(identifier)
+    return list(flatten(safe_camelcase_split(token) for token in parts if token))
 
 def simple_split(identifier):
     '''Split identifiers by hard delimiters such as underscores, digits, and
@@ -97,82 +95,102 @@ def simple_split(identifier):
     transition somewhere.  Example: ABCtestSplit -> ['ABCtest', 'Split'].
     '''
     parts = str.translate(identifier, _hard_splitter)
-    return re.sub(_camel_case, r' \1', parts).split()
+    return _camel_case.sub(r' \1', parts).split()
 
 
 # Main functions
 # .............................................................................
 
+# Converters to HTML for the formats that extract_text() handles, keyed by
+# file name extension.  Each value is a description used in log messages and
+# a function that takes the file name and the open file and returns HTML.
+# Testing showed better text output results for Markdown using the markdown
+# module than using pypandoc.  Don't know why, don't care.  Turns out pypandoc
+# can't handle .org files, though Pandoc can.
+# FIXME missing .rdoc, .pod, .wiki, .mediawiki, .creole
+
+_html_converters = {}
+for _ext in ['.md', '.markdown', '.mdwn', '.mkdn', '.mdown']:
+    _html_converters[_ext] = ('markdown', lambda name, file: html_from_markdown(file.read()))
+for _ext in ['.asciidoc', '.adoc', '.asc']:
+    _html_converters[_ext] = ('AsciiDoc', lambda name, file: html_from_asciidoc_file(name))
+for _ext in ['.texi', '.texinfo']:
+    _html_converters[_ext] = ('TeXinfo', lambda name, file: html_from_texinfo_file(name))
+for _ext in ['.docx', '.odt']:
+    _html_converters[_ext] = ('office ' + _ext, lambda name, file: html_from_pandoc(name))
+_html_converters['.rst']     = ('rST', lambda name, file: html_from_pandoc(name))
+_html_converters['.tex']     = ('LaTeX/TeX', lambda name, file: html_from_pandoc(name))
+_html_converters['.rtf']     = ('RTF', lambda name, file: html_from_rtf_file(name))
+_html_converters['.textile'] = ('Textile', lambda name, file: html_from_textile(file.read()))
+
+_html_file_converter = ('HTML', lambda name, file: file.read())
+_roff_file_converter = ('*roff', lambda name, file: html_from_roff_file(name))
+
+
+def html_converter(ext):
+    '''Return a tuple (description, converter) for files with extension
+    'ext', or None if the format is not one we can handle.'''
+    converter = _html_converters.get(ext)
+    if converter:
+        return converter
+    elif ext.startswith('.htm') or ext.startswith('.xht'):
+        return _html_file_converter
+    elif ext[1:].isdigit():
+        return _roff_file_converter
+    return None
+
+
+# extract_text() sets the process-wide locale to en_US.UTF-8.  It is done on
+# the first call rather than on every call, and not at import time, so that
+# merely importing this module leaves the locale alone.
+_locale_set = False
+
+def set_extraction_locale():
+    global _locale_set
+    if not _locale_set:
+        try:
+            locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+        except locale.Error:
+            pass
+        _locale_set = True
+
+
 def extract_text(filename, encoding='utf-8', retried=False):
+    # The converters for the different formats are imported where they are
+    # used, so that a process that never sees (say) a Textile file does not
+    # pay the cost of loading the Textile module.
     name, ext = os.path.splitext(filename.lower())
-    locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+    set_extraction_locale()
     log = Logger().get_log()
     try:
         with open(filename, 'r', encoding=encoding, errors='replace') as file:
             if ext in common_puretext_extensions:
                 log.info('extracting text from pure text file {}'.format(filename))
                 return clean_plain_text(file.read())
-            elif ext in ['.md', '.markdown', '.mdwn', '.mkdn', '.mdown']:
-                # Testing showed better text output results using markdown
-                # module than using pypandoc.  Don't know why, don't care.
-                log.info('extracting text from markdown file {}'.format(filename))
-                html = markdown.markdown(file.read(), output_format='html4')
-                return convert_html(html)
-            elif ext.startswith('.htm') or ext.startswith('.xht'):
-                log.info('extracting text from HTML file {}'.format(filename))
-                return convert_html(file.read())
-            elif ext in ['.asciidoc', '.adoc', '.asc']:
-                log.info('extracting text from AsciiDoc file {}'.format(filename))
-                html = html_from_asciidoc_file(filename)
-                return convert_html(html)
-            elif ext in ['.rst']:
-                log.info('extracting text from rST file {}'.format(filename))
-                html = html_from_pandoc(filename)
-                return convert_html(html)
-            elif ext in ['.rtf']:
-                log.info('extracting text from RTF file {}'.format(filename))
-                html = html_from_rtf_file(filename)
-                return convert_html(html)
-            elif ext in ['.textile']:
-                log.info('extracting text from Textile file {}'.format(filename))
-                html = textile.textile(file.read())
-                return convert_html(html)
-            elif ext in ['.tex']:
-                log.info('extracting text from LaTeX/TeX file {}'.format(filename))
-                html = html_from_pandoc(filename)
-                return convert_html(html)
-            elif ext in ['.docx', '.odt']:
-                log.info('extracting text from office {} file {}'
-                          .format(ext, filename))
-                html = html_from_pandoc(filename)
-                return convert_html(html)
-            elif ext in ['.texi', '.texinfo']:
-                log.info('extracting text from TeXinfo file {}'.format(filename))
-                html = html_from_texinfo_file(filename)
-                return convert_html(html)
-            # Turns out pypandoc can't handle .org files, though Pandoc can.
-            # elif ext in ['.org']:
-            #     log.debug('extracting text from org-mode file {}'.format(filename))
-            #     html = html_from_pandoc(filename)
-            #     return convert_html(html)
-            elif ext[1:].isdigit():
-                log.info('extracting text from *roff file {}'.format(filename))
-                html = html_from_roff_file(filename)
-                return convert_html(html)
-            else:
+            converter = html_converter(ext)
+            if not converter:
                 log.info('cannot handle {} file'.format(ext))
                 return None
-            # FIXME missing .rdoc, .pod, .wiki, .mediawiki, .creole
+            (description, convert) = converter
+            log.info('extracting text from {} file {}'.format(description, filename))
+            return convert_html(convert(filename, file))
     except UnicodeDecodeError:
         # File does use the encoding we tried. Try guessing actual encoding.
         # But catch if we've been here before, to prevent infinite recursion.
         if not retried:
+            # cchardet is a C binding with the same detect() interface as
+            # chardet and is much faster; fall back if it isn't installed.
+            try:
+                import cchardet as chardet
+            except ImportError:
+                import chardet
             guess = None
             with open(filename, 'rb') as f:
-                content = f.read(1024)
+                content = f.read(8192)
                 guess = content and chardet.detect(content)
             if guess and 'encoding' in guess:
-                if guess['encoding'] == 'ascii':
+                # cchardet reports names in upper case ('ASCII').
+                if guess['encoding'] and guess['encoding'].lower() == 'ascii':
                     # Using ascii usually leads to failures. UTF-8 is safer.
                     guess['encoding'] = 'utf-8'
                 return extract_text(filename, guess['encoding'], True)
@@ -183,11 +201,23 @@ def extract_text(filename, encoding='utf-8', retried=False):
                   .format(os.path.join(os.getcwd(), filename), e))
         return None
 
+
+def extract_text_batch(filenames, processes=None):
+    '''Run extract_text() on each of the files in 'filenames' using a pool
+    of worker processes, and return a dictionary mapping each file name to
+    its text.  Argument 'processes' is the number of workers; the default
+    is the number of CPUs.'''
+    with Pool(processes) as pool:
+        results = pool.map(extract_text, filenames, chunksize=8)
+    return dict(zip(filenames, results))
+
+
 _common_ignored_regexp = r'\(c\)|::|:-\)|:\)|:-\(|:-P|<3|->|-->'
 _common_ignored        = re.compile(_common_ignored_regexp, re.IGNORECASE)
 _divider_line          = re.compile(r'^\W*[-=_.+^*#~]{2,}\W*$', flags=re.MULTILINE)
-_multiple_blank_line   = re.compile(r'\n[ \t]*\n\n+')
-_two_newlines          = re.compile(r'(?<!\n)\n(?=[^\n])', flags=re.MULTILINE)
+_divider_run           = re.compile(r'[-=_.+^*#~]{2}', flags=re.ASCII)
+_multiple_blank_line   = re.compile(r'\n[ \t]*\n\n+', flags=re.ASCII)
+_two_newlines          = re.compile(r'(?<!\n)\n(?=[^\n])', flags=re.ASCII)
 _multiple_spaces       = re.compile(r'\s+')
 
 _rst_tags_regexp       = r'(:param|:return|:type|:rtype)'
@@ -200,37 +230,66 @@ _okay_ending_chars     = ('-', '–', '—', '…', '?', '!', '.', ',', ':', ';'
                           '‚', '‼', '⁇', '⁈', '⁉︎', '：', '；', '．', '，')
 _okay_endings = re.compile(r'([^'+''.join(_okay_ending_chars)+r'])([ \t]*)\n\n',
                            flags=re.MULTILINE)
+# Most of the endings are single characters and can be tested by set lookup.
+_okay_ending_set   = frozenset(c for c in _okay_ending_chars if len(c) == 1)
+_okay_ending_multi = tuple(c for c in _okay_ending_chars if len(c) > 1)
+
+# Languages for which clean_plain_text() does its full processing.
+_western_languages = frozenset([
+    'en', 'fr', 'cs', 'cu', 'cy', 'da', 'de', 'es', 'fi', 'fr', 'ga', 'hu',
+    'hy', 'is', 'it', 'la', 'nb', 'nl', 'no', 'pl', 'pt', 'ro', 'sk', 'sl',
+    'sv', 'tr', 'uk', 'eo',
+])
+
+# Number of recent language guesses to remember, and the longest text whose
+# guess is remembered.  Short boilerplate text (license notices, generated
+# docstrings) recurs across repositories; long documents rarely do, and
+# keeping them alive in the cache would cost far more memory than it saves.
+_language_cache_size = 1024
+_language_cache_max_length = 1024
+
+def cached_human_language(text):
+    '''Same as human_language(), but remembers recent results for short texts.'''
+    if len(text) > _language_cache_max_length:
+        return human_language(text)
+    return _short_text_language(text)
+
+
+@functools.lru_cache(maxsize=_language_cache_size)
+def _short_text_language(text):
+    return human_language(text)
+
 
 def clean_plain_text(text):
     '''Do limited cleaning of text that appears in Python code.'''
 
-    # Remove obvious divider lines, like lines of repeated dashes.
-    text = re.sub(_divider_line, ' ', text)
+    # Remove obvious divider lines, like lines of repeated dashes.  Most text
+    # has no run of divider characters at all, and finding that out is much
+    # cheaper than trying the line pattern at the start of every line.
+    if _divider_run.search(text):
+        text = _divider_line.sub(' ', text)
     # Compress multiple blank lines.
-    text = re.sub(_multiple_blank_line, '\n\n', text)
+    text = _multiple_blank_line.sub('\n\n', text)
     # Turn single newlines into spaces.
-    text = re.sub(_two_newlines, ' ', text)
+    text = _two_newlines.sub(' ', text)
 
     # Don't bother going further if it's not written in a Western-style language.
-    if human_language(text) not in ['en', 'fr', 'cs', 'cu', 'cy', 'da', 'de',
-                                    'es', 'fi', 'fr', 'ga', 'hu', 'hy', 'is',
-                                    'it', 'la', 'nb', 'nl', 'no', 'pl', 'pt',
-                                    'ro', 'sk', 'sl', 'sv', 'tr', 'uk', 'eo']:
+    if cached_human_language(text) not in _western_languages:
         return text.strip()
 
     # Get rid of funky Unicode characters
     text = unicodedata.normalize('NFKD', text)
     # Massage Sphinx style doc patterns to make it more clear where
     # sentence boundaries would be.
-    text = re.sub(_rst_tags, r'\n\n\1', text)
+    text = _rst_tags.sub(r'\n\n\1', text)
     # Remove random other things that are useless to us.
-    text = re.sub(_common_ignored, '', text)
+    text = _common_ignored.sub('', text)
     # If there are two newlines in a row, treat it like a paragraph break,
     # and see if the text prior to that point has an ending period.  If it
     # doesn't, add one, on the heuristic basis that it's likely a sentence end.
-    text = re.sub(_okay_endings, r'\1.\2\n\n', text)
+    text = _okay_endings.sub(r'\1.\2\n\n', text)
     # Compress multiple spaces into one.
-    text = re.sub(_multiple_spaces,  ' ', text)
+    text = _multiple_spaces.sub(' ', text)
     # Strip blank space at the beginning and end of the whole thing.
     return text.strip()
 
@@ -258,7 +317,8 @@ _common_abbrevs = set([
 
 _odd_chars         = '|<>&+=$%^'
 _odd_char_splitter = str.maketrans(_odd_chars, ' '*len(_odd_chars))
-_stray_punct       = re.compile('["`\',]')
+_stray_punct       = str.maketrans('', '', '"`\',')
+_newlines          = re.compile(r'\n+', re.ASCII)
 _max_word_length   = 80
 
 # Contractions can't be done entirely by regexp.  You need to use POS tagging
@@ -347,6 +407,12 @@ class ModifiedPunktLanguageVars(PunktLanguageVars):
     # so it's irrelevant to us.
     sent_end_chars = ('.', '?', '!', ':')
 
+# The sentence splitter carries no per-call state, so build it only once.
+_punkt_param = PunktParameters()
+_punkt_param.abbrev_types = _common_abbrevs
+_sentence_splitter = PunktSentenceTokenizer(_punkt_param,
+                                            lang_vars=ModifiedPunktLanguageVars())
+
 def tokenize_text(seq):
     '''Tokenizes a string containing one or more sentences, and returns a
     list of lists, with the outer list representing sentences and the inner
@@ -359,23 +425,18 @@ def tokenize_text(seq):
 
     def clean_words(sent):
         # Takes a list of words and cleans them to remove stray punctuation.
-        return [re.sub(_stray_punct, '', word) for word in sent]
+        return [word.translate(_stray_punct) for word in sent]
 
     # Replace common contractions that are safe to replace.
-    replacer = RegexpReplacer(_common_contractions)
-    text = replacer.replace(seq)
+    text = _contraction_replacer.replace(seq)
     # Compress multiple blank lines into one.
-    text = re.sub(r'\n+', '\n', text)
+    text = _newlines.sub('\n', text)
     # Remove URLs.
-    text = re.sub(url_compiled_regex, '', text)
+    text = url_compiled_regex.sub('', text)
     # Split words at certain characters that are not used in normal writing.
     text = str.translate(text, _odd_char_splitter)
     # Split the text into sentences.
-    punkt_vars = ModifiedPunktLanguageVars()
-    punkt_param = PunktParameters()
-    punkt_param.abbrev_types = _common_abbrevs
-    sentence_splitter = PunktSentenceTokenizer(punkt_param, lang_vars=punkt_vars)
-    sentences = sentence_splitter.tokenize(text, realign_boundaries=True)
+    sentences = _sentence_splitter.tokenize(text, realign_boundaries=True)
     # Tokenize each sentence individually.
     sentences = [nltk.word_tokenize(sent) for sent in sentences]
     # Filter out items that don't have any letters in them, or are too long.
@@ -560,49 +621,55 @@ class RegexpReplacer(object):
     def replace(self, text):
         s = text
         for (pattern, repl) in self.patterns:
-            s = re.sub(pattern, repl, s)
+            s = pattern.sub(repl, s)
         return s
 
+# The contraction patterns are compiled once, for all calls to tokenize_text().
+_contraction_replacer = RegexpReplacer(_common_contractions)
+
 # Word-testing function and associated regexp's.
 
-_letter         = re.compile(r'[a-zA-Z]')
-_nonword_letter = re.compile(r"[^-'_.a-zA-Z]")
+_letters        = frozenset(string.ascii_letters)
+_nonword_letter = re.compile(r"[^-'_.a-zA-Z]", re.ASCII)
 _repeated_char  = re.compile(r'(.)\1{4,}')
 _repeated_seq   = re.compile(r'(.)\1{2,}(.)\2{2,}')
 _repeated_pat3  = re.compile(r'(.)(.)(.)\1\2\3\1\2\3')
 _repeated_pat4  = re.compile(r'(.)(.)(.)(.)\1\2\3\4\1\2\3\4')
-_dna            = re.compile(r'[atgc]{6,}', re.I)
-_rna            = re.compile(r'[augc]{6,}', re.I)
-_imb            = re.compile(r'[adft]{31,}', re.I)
+_dna            = re.compile(r'[atgc]{6,}', re.I | re.ASCII)
+_rna            = re.compile(r'[augc]{6,}', re.I | re.ASCII)
+_imb            = re.compile(r'[adft]{31,}', re.I | re.ASCII)
 _alphabet       = re.compile(r'abcdefghijklmno', re.I)
 _random_nonword = re.compile(r'[bcdfghjklmnpqrstvwxzy]{9,}', re.I)
 
+# Characters at which extract_text_words() splits words.
+_word_delimiters = re.compile(r'[-/_.:\\0123456789’*]').split
+
 def is_word(token):
     # Returns true if 'token' is plausibly a word.
     return (token
             and len(token) <= _max_word_length
             # Must have at least one letter.
-            and re.search(_letter, token)
+            and not _letters.isdisjoint(token)
             # Ignore tokens that have un-text-like characters in them.
-            and not re.search(_nonword_letter, token)
+            and not _nonword_letter.search(token)
             # Ignore tokens containing strings of 5 or more repeated chars.
             # The threshold is high to avoid catching most Roman numerals.
-            and not re.search(_repeated_char, token)
+            and not _repeated_char.search(token)
             # Ignore things that look like DNA or RNA sequences (!).
             # This is kind of conservative to avoid catching other things.
             # E.g.: "baggage", "Atacama", "attachment", "datatable".
-            and not re.search(_dna, token)
-            and not re.search(_rna, token)
+            and not _dna.search(token)
+            and not _rna.search(token)
             # Ignore USPS Intelligent Mail Barcode (IMb) barcodes.
-            and not re.search(_imb, token)
+            and not _imb.search(token)
             # Ignore what looks like the alphabet.
-            and not re.search(_alphabet, token)
+            and not _alphabet.search(token)
             # Ignore repeating shit like "aaabbb".
-            and not re.search(_repeated_seq, token)
-            and not re.search(_repeated_pat3, token)
-            and not re.search(_repeated_pat4, token)
+            and not _repeated_seq.search(token)
+            and not _repeated_pat3.search(token)
+            and not _repeated_pat4.search(token)
             # Random sequences
-            and not (re.search(_random_nonword, token) and len(token) >= 50))
+            and not (len(token) >= 50 and _random_nonword.search(token)))
 
 
 # Utility functions.
@@ -619,18 +686,18 @@ def extract_text_words(body):
     '''
     words = flatten(tokenize_text(body))
     # Remove words that are URLs.
-    words = [w for w in words if not re.search(url_compiled_regex, w)]
-    words = [w for w in words if not re.search(mail_compiled_regex, w)]
+    words = [w for w in words if not url_compiled_regex.search(w)]
+    words = [w for w in words if not mail_compiled_regex.search(w)]
     # Remove / from paths to leave individual words: /usr/bin -> usr bin
     # Also split words at hyphens and other delimiters while we're at it.
     # Also split words at numbers, e.g., "rtf2html" -> "rtf", "html".
-    words = flatten(re.split(r'[-/_.:\\0123456789’*]', w) for w in words)
+    words = flatten(_word_delimiters(w) for w in words)
     # Remove words that contain non-ASCII characters.
     words = [w for w in words if is_ascii(w)]
     # Remove terms that have no letters.
-    words = [w for w in words if re.search(r'[a-zA-Z]+', w)]
+    words = [w for w in words if not _letters.isdisjoint(w)]
     # Remove terms that contain unusual characters embedded, like %s.
-    words = [w for w in words if not re.search(r'[%]', w)]
+    words = [w for w in words if '%' not in w]
     # Do strict camel case splitting: this is relatively safe for identifiers
     # like 'handleFileUpload' and yet won't screw up 'GPSmodule'.
     return list(flatten(safe_camelcase_split(w) for w in words))
@@ -655,6 +722,27 @@ def extract_code_identifiers(body, splitter):
     return ids
 
 
+def html_from_textile(text):
+    '''Convert Textile text to HTML.'''
+    import textile
+    return textile.textile(text)
+
+
+# Markdown converters, created on first use and then reused.  Setting up a
+# Markdown instance loads its extensions and builds its processors, which is
+# more work than converting a typical README.  A Markdown instance keeps state
+# while it converts, so each thread gets its own.
+_markdown = threading.local()
+
+def html_from_markdown(text):
+    '''Convert Markdown text to HTML.'''
+    converter = getattr(_markdown, 'converter', None)
+    if converter is None:
+        import markdown
+        converter = _markdown.converter = markdown.Markdown(output_format='html4')
+    return converter.reset().convert(text)
+
+
 def html_from_pandoc(filename):
     '''Convert asciidoc file to HTML.'''
     # Gave up on pypandoc because I ran into a file that caused it to never
@@ -721,6 +809,13 @@ def html_from_rdoc_file(filename):
     return output_from_external_converter(cmd)
 
 
+def okay_ending(text):
+    '''Return True if 'text', ignoring trailing whitespace, ends with one of
+    the characters in _okay_ending_chars.'''
+    text = text.rstrip()
+    return text[-1:] in _okay_ending_set or text.endswith(_okay_ending_multi)
+
+
 # After looking at a lot of real-life README files and the result of its
 # conversion to text by Pandoc and other converters, I noticed that the text
 # often lacks punctuation that would indicate full sentences.  For human
@@ -735,6 +830,8 @@ def convert_html(html):
     the result is more easily parsed into sentences by later tools.  Script
     elements and HTML comments are removed, as a <pre> and <img> elements.
     '''
+    import bs4
+
     def ignorable_type(el):
         return type(el) in [bs4.Doctype, bs4.Comment, bs4.ProcessingInstruction]
 
@@ -742,8 +839,9 @@ def convert_html(html):
 
     # If the input is not in English, we're not going to do NL processing on
     # it anyway and we can skip the rest of this process.  For speed, this
-    # check only considers the first few paragraphs.
-    paragraphs = soup.find_all('p')
+    # check only considers the first few paragraphs, and the search stops as
+    # soon as it has found them.
+    paragraphs = soup.find_all('p', limit=5)
     p_text = ''.join(p.text for p in paragraphs[1:5])
     if p_text and human_language(p_text) != 'en':
         return unsoupify(soup)
@@ -752,28 +850,20 @@ def convert_html(html):
     for el in soup.find_all(text=lambda text: ignorable_type(text)):
         el.extract()
 
-    # Remove scripts.
-    for el in soup.find_all('script'):
+    # Remove scripts and style elements.  Also ignore pre and img because we
+    # don't have a good way of dealing with them.  One pass finds them all.
+    for el in soup.find_all(['script', 'style', 'pre', 'img']):
         el.extract()
 
-    # Remove style elements.
-    for el in soup.find_all('style'):
-        el.extract()
-
-    # Ignore pre and img because we don't have a good way of dealing with them.
-    for ignorable in ['pre', 'img']:
-        for el in soup.find_all(ignorable):
-            el.extract()
-
     for htype in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
         # Add periods at the ends of headings (to make them look like sentences)
         for el in soup.find_all(htype):
-            if not el.text.rstrip().endswith(_okay_ending_chars):
+            if not okay_ending(el.text):
                 el.append('.')
 
     for el in soup.find_all('p'):
         # Add periods at the ends of paragraphs if necessary.
-        if not el.text.rstrip().endswith(_okay_ending_chars):
+        if not okay_ending(el.text):
             el.append('.')
 
     for list_type in ['ul', 'ol']:
@@ -785,23 +875,25 @@ def convert_html(html):
             for i, li in enumerate(list_elements, start=1):
                 # Add commas after list elements if they have no other
                 # punctuation, and add a period after the last element.
-                if li.string and not li.string.rstrip().endswith(_okay_ending_chars):
+                if li.string and not okay_ending(li.string):
                     if i == last:
                         li.append('.')
                     else:
                         li.append(',')
 
-    for el in soup.find_all('dl'):
+    # Once a term has been given punctuation it no longer has a single
+    # .string, so doing this once covers every definition list.
+    if soup.find('dl'):
         for d in soup.find_all('dt'):
-            if d.string and not d.string.rstrip().endswith(_okay_ending_chars):
+            if d.string and not okay_ending(d.string):
                 d.append(':')
         for d in soup.find_all('dd'):
-            if d.string and not d.string.rstrip().endswith(_okay_ending_chars):
+            if d.string and not okay_ending(d.string):
                 d.append('.')
 
     for table_element in ['th', 'td']:
         for el in soup.find_all(table_element):
-            if el.string and not el.string.rstrip().endswith(_okay_ending_chars):
+            if el.string and not okay_ending(el.string):
                 # This one adds a space afterwards, because for some reason
                 # BS doesn't put spaces after these elements when you do the
                 # find_all(text=True) at the end.
@@ -826,7 +918,7 @@ def is_ascii(s):
 
 def unsoupify(soup):
     '''Convert BeautifulSoup output to a text string.'''
-    text = re.sub(r'\n', ' ', ''.join(soup.find_all(text=True)))
+    text = ''.join(soup.find_all(text=True)).replace('\n', ' ')
     text = unicodedata.normalize('NFKD', text)
     return text
 
@@ -0,0 +1,3 @@
+# The repositories under testrepos are sample input for the parsers, and
+# their own test suites are not meant to be collected.
+collect_ignore_glob = ['testrepos/*']
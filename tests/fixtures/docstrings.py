@@ -0,0 +1,11 @@
+class Settings:
+    timeout = 'thirty seconds, then give up'
+    retries = 3
+
+class Documented:
+    '''The class docstring.'''
+    verbose = True
+
+def configure():
+    mode = 'a string assignment, not a docstring'
+    return mode
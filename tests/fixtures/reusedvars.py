@@ -0,0 +1,6 @@
+def first():
+    counter = 1
+    counter = 2
+
+def second():
+    counter = 3
@@ -0,0 +1,11 @@
+class Outer:
+    shared = 1
+    def method(self, value):
+        shared = 2
+        class Inner:
+            shared = 3
+        after_inner = 4
+    after_method = 5
+
+def function():
+    shared = 6
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import ast
+import os
+import pytest
+import sys
+
+tests_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..'))
+
+from extractor.file_parser import ElementCollector, file_elements
+
+fixtures_dir = os.path.join(tests_dir, 'fixtures')
+
+def collect(filename):
+    collector = ElementCollector()
+    with open(os.path.join(fixtures_dir, filename)) as f:
+        collector.visit(ast.parse(f.read()))
+    return collector
+
+
+class TestClass:
+    def test_nested_scopes(self):
+        # A class body is its own scope, even inside a function, and the
+        # enclosing scope is restored after a nested class or function.
+        expected = [('Outer', 'shared'), ('Outer.method', 'value'),
+                    ('Outer.method', 'shared'), ('Outer.method.Inner', 'shared'),
+                    ('Outer.method', 'after_inner'), ('Outer', 'after_method'),
+                    ('function', 'shared')]
+        collector = collect('scopetest.py')
+        assert(collector.variables == expected)
+        assert(collector.classes == ['Outer', 'Outer.method.Inner'])
+        assert(collector.functions == ['Outer.method', 'function'])
+
+    def test_first_statement_assignments(self):
+        # Only a bare string as the first statement is a docstring.  An
+        # assignment in that position, even of a string, is a variable.
+        collector = collect('docstrings.py')
+        assert(collector.variables == [('Settings', 'timeout'),
+                                       ('Settings', 'retries'),
+                                       ('Documented', 'verbose'),
+                                       ('configure', 'mode')])
+        assert(collector.docstrings == ['The class docstring.'])
+        file = os.path.join(fixtures_dir, 'docstrings.py')
+        elements = file_elements(file)
+        assert(elements['docstrings'] == ['The class docstring.'])
+        assert(('timeout', 1) in elements['variables'])
+
+    def test_reused_variable_names(self):
+        # A name assigned twice in one function counts once; the same name
+        # in another function counts again.
+        file = os.path.join(fixtures_dir, 'reusedvars.py')
+        elements = file_elements(file)
+        assert(elements['variables'] == [('counter', 2)])
+        assert(elements['functions'] == [('first', 1), ('second', 1)])